@@ -1,4 +1,7 @@
 from abc import abstractmethod, ABC
+import collections
+import heapq
+import itertools
 import typing
 
 
@@ -7,6 +10,15 @@ TokenList = typing.List[int]
 A list of tokens, where each token is represented as an integer.
 '''
 
+TokenSequence = typing.Union[TokenList, bytes]
+'''
+A list of tokens, or the UTF-8 encoded bytes of text before any of its tokens
+have been merged. Indexing and iterating over bytes gives each byte as an
+integer, so bytes can be passed wherever tokens are only read. Merging is done
+in place on a mutable list, so the tokens are copied into a list before they
+are merged.
+'''
+
 TokenPair = typing.Tuple[int, int]
 '''
 A pair of tokens, where each token is represented as an integer.`
@@ -18,10 +30,24 @@ The pair counts dictionary maps pairs of tokens to the number of times they
 occur consecutively.
 '''
 
-Merges = typing.OrderedDict[typing.Tuple[int, int], int]
+PairHeap = typing.List[typing.Tuple[int, typing.Tuple[int, int]]]
+'''
+A heap of negated pair counts and pairs, such that the most frequently occurring
+pair is at the top of the heap. Entries may be stale, so the count of an entry
+must be checked against the pair counts dictionary when it is popped.
+'''
+
+PairPositions = typing.Dict[typing.Tuple[int, int], typing.Set[int]]
+'''
+The pair positions dictionary maps pairs of tokens to the positions of the first
+token of every place they occur consecutively.
+'''
+
+Merges = typing.Dict[typing.Tuple[int, int], int]
 '''
 The merges that were applied during the byte pair encoding algorithm, in order.
-Each merge replaces a pair of tokens with a new token.
+Each merge replaces a pair of tokens with a new token. Dictionaries preserve
+insertion order, so the merges are kept in the order they were applied in.
 '''
 
 VocabDict = typing.Dict[int, bytes]
@@ -30,8 +56,18 @@ Mapping of each of the replacement tokens to the bytes that it replaced.
 '''
 
 
+_INITIAL_VOCAB: VocabDict = {idx: bytes([idx]) for idx in range(256)}
+'''
+The vocabulary before any merges, mapping each byte to itself. It is copied at
+the start of training rather than rebuilt every time.
+'''
+
+
 class Tokenizer(ABC):
 
+    _merges: typing.Optional[Merges]
+    _merges_per_pass: int
+
     @abstractmethod
     def train(self, text: str, vocab_size: int):
         pass
@@ -43,3 +79,578 @@ class Tokenizer(ABC):
     @abstractmethod
     def decode(self, encoded_tokens: TokenList)-> str:
         pass
+
+    def _apply_merges(self, tokens: TokenSequence) -> TokenList:
+        '''
+        Applies the learned merges to a list of tokens, giving the same tokens
+        as merging every pair in `self._merges` one after the other, but in a
+        single pass over the tokens.
+
+        The replacement tokens are created in the order the merges are learned,
+        so the replacement token of a pair is also its rank. The adjacent pairs
+        are kept in a heap ordered by rank and position, and the lowest-ranked,
+        left-most pair is merged each time. The tokens are kept in a linked list
+        so that a merge only needs to update its neighbours. Heap entries whose
+        position no longer holds the same pair are stale and are skipped.
+
+        Args:
+            tokens (List[int] | bytes): The list of tokens to be merged. It is
+                copied rather than merged in place.
+
+        Returns:
+            List[int]: The tokens after all of the merges have been applied.
+        '''
+
+        merges = self._merges
+        tokens = list(tokens)
+        end = len(tokens)
+
+        # The positions of the tokens before and after each token, where a
+        # merged token is removed by linking around it
+        previous_positions = list(range(-1, end - 1))
+        next_positions = list(range(1, end + 1))
+
+        pair_heap = [
+            (merges[pair], i)
+            for i, pair in enumerate(zip(tokens, tokens[1:]))
+            if pair in merges
+        ]
+        heapq.heapify(pair_heap)
+
+        while pair_heap:
+            rank, i = heapq.heappop(pair_heap)
+            j = next_positions[i]
+
+            if (
+                tokens[i] is None
+                or j == end
+                or merges.get((tokens[i], tokens[j])) != rank
+            ):
+                continue
+
+            # Replace the pair with its replacement token, which is its rank,
+            # and remove the second token of the pair from the list
+            tokens[i] = rank
+            tokens[j] = None
+            k = next_positions[j]
+            next_positions[i] = k
+            if k != end:
+                previous_positions[k] = i
+
+            # Push the pairs that the replacement token forms with its new
+            # neighbours
+            h = previous_positions[i]
+            if h != -1 and (tokens[h], rank) in merges:
+                heapq.heappush(pair_heap, (merges[(tokens[h], rank)], h))
+            if k != end and (rank, tokens[k]) in merges:
+                heapq.heappush(pair_heap, (merges[(rank, tokens[k])], i))
+
+        return [token for token in tokens if token is not None]
+
+    def _count_pairs(self, tokens: TokenSequence) -> typing.Counter[TokenPair]:
+        '''
+        Counts the number of times each pair of tokens occurs consecutively in
+        `tokens`.
+
+        Note that if a pair of tokens does not occur consecutively in tokens,
+        then it will not be present in the output dictionary.
+
+        Args:
+            tokens (List[int] | bytes): The list of tokens to be processed.
+
+        Returns:
+            Counter[Tuple[int, int]]: A counter mapping every consecutive pair
+            of tokens that occurs consecutively in `tokens` to the number of
+            times it does so. Pairs that do not occur have a count of zero, so
+            the counts can be incremented directly as new pairs are formed.
+        '''
+
+        # Counting the pairs with a counter keeps the counting loop in C, and
+        # pairing the tokens with an iterator over them avoids copying them
+        return collections.Counter(
+            zip(tokens, itertools.islice(tokens, 1, None))
+        )
+
+    def _merge_positions(
+        self,
+        tokens: typing.List[typing.Optional[int]],
+        previous_positions: typing.List[int],
+        next_positions: typing.List[int],
+        weights: typing.List[int],
+        pair_positions: PairPositions,
+        pair_to_replace: TokenPair,
+        replacement_token: int,
+        pair_counts: typing.Counter[TokenPair],
+        changed_pairs: typing.Set[TokenPair]
+    ):
+        '''
+        Merges a linked list of tokens in place with a conditional replacement
+        token. Every occurrence of `pair_to_replace` in `tokens` will be
+        replaced by `replacement_token`.
+
+        The tokens are linked through `previous_positions` and
+        `next_positions`, and the position of every occurrence of each pair is
+        kept in `pair_positions`. Only the positions at which `pair_to_replace`
+        occurs are visited, so the cost of a merge depends on the number of
+        occurrences of the pair rather than on the number of tokens. Each
+        occurrence is replaced by writing the replacement token over the first
+        token of the pair and setting the second token to `None`, linking
+        around it.
+
+        `pair_counts` and `changed_pairs` are updated as in
+        `_update_pair_counts`, with each occurrence weighted by the weight of
+        its position, and `pair_positions` is updated along with them.
+
+        Args:
+            tokens (List[Optional[int]]): The tokens, where removed tokens are
+                `None`.
+
+            previous_positions (List[int]): The position of the token before
+                each token, or -1 if there is none.
+
+            next_positions (List[int]): The position of the token after each
+                token, or `len(tokens)` if there is none.
+
+            weights (List[int]): The number of times the token at each position
+                occurs.
+
+            pair_positions (Dict[Tuple[int, int], Set[int]]): The positions of
+                the first token of every occurrence of each pair of tokens.
+
+            pair_to_replace (Tuple[int, int]): The pair of tokens to be replaced
+                by the replacement token wherever it occurs in `tokens`.
+
+            replacement_token (int): The token with which to replace occurrences
+                of the replacement pair in `tokens`.
+
+            pair_counts (Counter[Tuple[int, int]]): The counter of pair counts
+                of `tokens` to be updated.
+
+            changed_pairs (Set[Tuple[int, int]]): The set of pairs to add the
+                pairs whose count increases to.
+        '''
+
+        first, second = pair_to_replace
+        end = len(tokens)
+
+        # The occurrences are replaced from left to right, so that overlapping
+        # occurrences of a pair like (a, a) are merged the same way as when
+        # walking over the tokens
+        positions = sorted(pair_positions.pop(pair_to_replace, ()))
+
+        for i in positions:
+            j = next_positions[i]
+
+            # An overlapping occurrence may have already been merged
+            if tokens[i] != first or j == end or tokens[j] != second:
+                continue
+
+            h = previous_positions[i]
+            k = next_positions[j]
+
+            self._update_pair_counts(
+                pair_counts,
+                tokens[h] if h != -1 else None,
+                pair_to_replace,
+                tokens[k] if k != end else None,
+                replacement_token,
+                changed_pairs,
+                weights[i]
+            )
+
+            # Looking the old pairs up with `get` avoids creating empty sets for
+            # them in the default dictionary
+            if h != -1:
+                pair_positions.get((tokens[h], first), set()).discard(h)
+                pair_positions[(tokens[h], replacement_token)].add(h)
+
+            if k != end:
+                pair_positions.get((second, tokens[k]), set()).discard(j)
+                pair_positions[(replacement_token, tokens[k])].add(i)
+                previous_positions[k] = i
+
+            tokens[i] = replacement_token
+            tokens[j] = None
+            next_positions[i] = k
+
+    def _update_pair_counts(
+        self,
+        pair_counts: typing.Counter[TokenPair],
+        previous_token: typing.Optional[int],
+        replaced_pair: TokenPair,
+        next_token: typing.Optional[int],
+        replacement_token: int,
+        changed_pairs: typing.Set[TokenPair],
+        frequency: int
+    ):
+        '''
+        Updates `pair_counts` in place for a single occurrence of
+        `replaced_pair` being replaced by `replacement_token`. The pairs that
+        the replaced pair formed with its neighbours are decremented, and the
+        pairs that the replacement token forms with them are incremented. Each
+        count changes by `frequency`, the number of times the chunk of tokens
+        containing the occurrence occurs.
+
+        The incremented pairs are added to `changed_pairs`, so that they can be
+        pushed onto the heap of pair counts once after the whole merge rather
+        than once per occurrence (see `_push_pairs`). The heap entries of
+        decremented pairs are left stale and are corrected when they are popped
+        (see `_pop_top_pair`).
+
+        Args:
+            pair_counts (Counter[Tuple[int, int]]): The counter of pair counts
+                to be updated. Pairs that are not in it yet have a count of
+                zero.
+
+            previous_token (Optional[int]): The token before the replaced pair,
+                or `None` if the pair is at the start of the tokens.
+
+            replaced_pair (Tuple[int, int]): The pair of tokens being replaced.
+
+            next_token (Optional[int]): The token after the replaced pair, or
+                `None` if the pair is at the end of the tokens.
+
+            replacement_token (int): The token replacing `replaced_pair`.
+
+            changed_pairs (Set[Tuple[int, int]]): The set of pairs to add the
+                incremented pairs to.
+
+            frequency (int): The number of times the chunk of tokens containing
+                the occurrence occurs.
+        '''
+
+        first, second = replaced_pair
+
+        removed_pairs = [replaced_pair]
+        added_pairs = []
+
+        if previous_token is not None:
+            removed_pairs.append((previous_token, first))
+            added_pairs.append((previous_token, replacement_token))
+
+        if next_token is not None:
+            removed_pairs.append((second, next_token))
+            added_pairs.append((replacement_token, next_token))
+
+        for pair in removed_pairs:
+            pair_counts[pair] -= frequency
+            if pair_counts[pair] == 0:
+                del pair_counts[pair]
+
+        for pair in added_pairs:
+            pair_counts[pair] += frequency
+
+        changed_pairs.update(added_pairs)
+
+    def _push_pairs(
+        self,
+        pair_counts: PairCounts,
+        pair_heap: PairHeap,
+        pairs: typing.Iterable[TokenPair]
+    ):
+        '''
+        Pushes each of `pairs` that still occurs onto `pair_heap` with its count
+        in `pair_counts`.
+
+        Args:
+            pair_counts (Dict[Tuple[int, int], int]): The dictionary of pair
+                counts.
+
+            pair_heap (List[Tuple[int, Tuple[int, int]]]): The heap of pair
+                counts to push the pairs onto.
+
+            pairs (Iterable[Tuple[int, int]]): The pairs to be pushed.
+        '''
+
+        for pair in pairs:
+            count = pair_counts.get(pair, 0)
+            if count > 0:
+                heapq.heappush(pair_heap, (-count, pair))
+
+    def _pop_top_pair(
+        self,
+        pair_counts: PairCounts,
+        pair_heap: PairHeap,
+        pair_positions: PairPositions
+    ) -> TokenPair:
+        '''
+        Pops the most commonly-occurring pair of tokens off of `pair_heap`. Of
+        the pairs that occur equally often, the one that occurs first is popped
+        (see `_find_first_pair`).
+
+        Every pair in `pair_counts` has an entry in the heap whose count is at
+        least the pair's actual count, so stale entries are skipped until an
+        entry agrees with `pair_counts`. Entries that overestimate the count of
+        a pair are pushed back with the pair's actual count. The entries of the
+        other pairs with the top count are pushed back after the first one has
+        been found.
+
+        Args:
+            pair_counts (Dict[Tuple[int, int], int]): The dictionary of pair
+                counts.
+
+            pair_heap (List[Tuple[int, Tuple[int, int]]]): The heap of pair
+                counts.
+
+            pair_positions (Dict[Tuple[int, int], Set[int]]): The positions of
+                the first token of every occurrence of each pair of tokens.
+
+        Returns:
+            Tuple[int, int]: The pair of tokens with the highest count.
+        '''
+
+        while True:
+            negated_count, pair = heapq.heappop(pair_heap)
+            count = pair_counts.get(pair, 0)
+
+            if count == -negated_count:
+                break
+
+            if 0 < count < -negated_count:
+                heapq.heappush(pair_heap, (-count, pair))
+
+        # Pop the other pairs with the same count, so that the one of them that
+        # occurs first can be chosen
+        top_pairs = {pair}
+        while pair_heap and pair_heap[0][0] == negated_count:
+            _, pair = heapq.heappop(pair_heap)
+            count = pair_counts.get(pair, 0)
+
+            if count == -negated_count:
+                top_pairs.add(pair)
+            elif count > 0:
+                heapq.heappush(pair_heap, (-count, pair))
+
+        if len(top_pairs) == 1:
+            return top_pairs.pop()
+
+        top_pair = self._find_first_pair(pair_positions, top_pairs)
+
+        for pair in top_pairs:
+            if pair != top_pair:
+                heapq.heappush(pair_heap, (negated_count, pair))
+
+        return top_pair
+
+    def _find_first_pair(
+        self,
+        pair_positions: PairPositions,
+        pairs: typing.Set[TokenPair]
+    ) -> TokenPair:
+        '''
+        Finds the pair of tokens out of `pairs` that occurs first, which is the
+        pair with the lowest position in `pair_positions`. Positions are never
+        reordered by a merge, so the lowest position is the first occurrence.
+        When the tokens are chunks laid out in the order they first occur in
+        the text, this is the pair that occurs first in the text.
+
+        Args:
+            pair_positions (Dict[Tuple[int, int], Set[int]]): The positions of
+                the first token of every occurrence of each pair of tokens.
+
+            pairs (Set[Tuple[int, int]]): The pairs to search for, all of which
+                occur at least once.
+
+        Returns:
+            Tuple[int, int]: The pair out of `pairs` that occurs first.
+        '''
+
+        return min(pairs, key=lambda pair: min(pair_positions[pair]))
+
+    def _pop_top_pairs(
+        self,
+        pair_counts: PairCounts,
+        pair_heap: PairHeap,
+        pair_positions: PairPositions,
+        number_of_pairs: int
+    ) -> typing.List[TokenPair]:
+        '''
+        Pops up to `number_of_pairs` of the most commonly-occurring pairs of
+        tokens off of `pair_heap`, such that none of the popped pairs share a
+        token with each other and they can be merged in a single pass.
+
+        The top `number_of_pairs` pairs are considered in the order they are
+        popped in (see `_pop_top_pair`), and any pair that shares a token with
+        a pair before it is pushed back onto the heap instead of being
+        returned.
+
+        Args:
+            pair_counts (Dict[Tuple[int, int], int]): The dictionary of pair
+                counts.
+
+            pair_heap (List[Tuple[int, Tuple[int, int]]]): The heap of pair
+                counts.
+
+            pair_positions (Dict[Tuple[int, int], Set[int]]): The positions of
+                the first token of every occurrence of each pair of tokens.
+
+            number_of_pairs (int): The maximum number of pairs to pop.
+
+        Returns:
+            List[Tuple[int, int]]: The popped pairs of tokens, from the highest
+            count to the lowest.
+        '''
+
+        top_pairs = [
+            self._pop_top_pair(pair_counts, pair_heap, pair_positions)
+        ]
+        used_tokens = set(top_pairs[0])
+        skipped_pairs = []
+
+        while (
+            len(top_pairs) + len(skipped_pairs)
+            < min(number_of_pairs, len(pair_counts))
+        ):
+            pair = self._pop_top_pair(pair_counts, pair_heap, pair_positions)
+
+            if used_tokens.isdisjoint(pair):
+                top_pairs.append(pair)
+                used_tokens.update(pair)
+            else:
+                skipped_pairs.append(pair)
+
+        self._push_pairs(pair_counts, pair_heap, skipped_pairs)
+
+        return top_pairs
+
+    def _byte_pair_encode(
+        self,
+        token_chunks: typing.List[TokenSequence],
+        chunk_frequencies: typing.List[int],
+        original_vocab_size: int,
+        number_of_merges: int
+    ) -> typing.Tuple[VocabDict, Merges]:
+        '''
+        Applies the byte pair encoding algorithm to a list of chunks of tokens
+        by merging the most frequently occurring pair in the tokens with a new
+        token `number_of_merges` times. Pairs do not span across chunks. Up to
+        `self._merges_per_pass` pairs are chosen from the same pair counts.
+
+        Args:
+            token_chunks (List[List[int] | bytes]): The list of unique chunks of
+                tokens on which to apply the byte pair encoding algorithm. The
+                chunks are copied into a single list of tokens, which is the
+                list that is merged.
+
+            chunk_frequencies (List[int]): The number of times each chunk in
+                `token_chunks` occurs.
+
+            original_vocab_size (int): The original number of unique tokens in
+                the vocabulary.
+
+            number_of_merges (int): The number of iterations to run the byte
+                pair encoding algorithm. More merges means more pairs of tokens
+                will be replaced by a new token.
+
+        Returns:
+            Tuple[VocabDict, Merges]: A tuple containing:
+            - `VocabDict`: a dictionary mapping each replacement token to the
+              bytes it replaced. Note that the bytes may be more than a pair
+              (like if a replacement token is a replacement of a replacement).
+            - `Merges`: a dictionary mapping pairs of tokens to the new
+              replacement token that replaced the pair, in the order they were
+              applied in.
+
+        Raises:
+            ValueError: If the tokens run out of pairs before
+                `number_of_merges` merges have been made.
+        '''
+
+        merges: Merges = {}
+        vocab = _INITIAL_VOCAB.copy()
+
+        # Lay the chunks out one after the other in a single linked list of
+        # tokens, where the tokens at the ends of a chunk are not linked to the
+        # chunks next to it. Each position is weighted by the number of times
+        # its chunk occurs.
+        tokens = []
+        end = sum(map(len, token_chunks))
+        previous_positions = []
+        next_positions = []
+        weights = []
+
+        # Count all the consecutive pairs of tokens once, along with the
+        # positions at which they occur, so that merging a pair only visits its
+        # occurrences. The counts are then kept up to date by each merge.
+        pair_counts = collections.Counter()
+        pair_positions = collections.defaultdict(set)
+
+        for chunk, frequency in zip(token_chunks, chunk_frequencies):
+            start = len(tokens)
+            tokens.extend(chunk)
+            stop = len(tokens)
+
+            if start == stop:
+                continue
+
+            previous_positions.append(-1)
+            previous_positions.extend(range(start, stop - 1))
+            next_positions.extend(range(start + 1, stop))
+            next_positions.append(end)
+            weights.extend(itertools.repeat(frequency, stop - start))
+
+            for pair, count in self._count_pairs(chunk).items():
+                pair_counts[pair] += count * frequency
+
+            pairs = zip(chunk, itertools.islice(chunk, 1, None))
+            for i, pair in enumerate(pairs, start):
+                pair_positions[pair].add(i)
+
+        # Keep the pairs in a heap as well, so that the most commonly-occurring
+        # pair can be found without scanning all of the pair counts
+        pair_heap = [(-count, pair) for pair, count in pair_counts.items()]
+        heapq.heapify(pair_heap)
+
+        while len(merges) < number_of_merges:
+            if not pair_counts:
+                raise ValueError(
+                    'vocab_size is larger than the text supports, no pairs of '
+                    f'tokens are left to merge after {len(merges)} merges'
+                )
+
+            # Get the most commonly-occurring consecutive pairs of tokens that
+            # can be merged in a single pass
+            top_pairs = self._pop_top_pairs(
+                pair_counts,
+                pair_heap,
+                pair_positions,
+                min(self._merges_per_pass, number_of_merges - len(merges))
+            )
+
+            replacements: Merges = {}
+
+            for top_pair in top_pairs:
+                # Make a new token
+                new_index = original_vocab_size + len(merges)
+
+                # Map the top pair to the new token created for it
+                merges[top_pair] = new_index
+                replacements[top_pair] = new_index
+
+                # Map the new token to the pair of tokens that it replaced
+                vocab[new_index] = vocab[top_pair[0]] + vocab[top_pair[1]]
+
+            # Replace the top pairs with the new tokens in the list of tokens,
+            # updating the pair counts along the way. The pairs do not share
+            # any tokens, so they can be merged one after the other.
+            changed_pairs = set()
+            for top_pair, new_index in replacements.items():
+                self._merge_positions(
+                    tokens,
+                    previous_positions,
+                    next_positions,
+                    weights,
+                    pair_positions,
+                    top_pair,
+                    new_index,
+                    pair_counts,
+                    changed_pairs
+                )
+
+            for top_pair in top_pairs:
+                pair_counts.pop(top_pair, None)
+
+            # Each pair formed by the merges is pushed once with its final count
+            self._push_pairs(pair_counts, pair_heap, changed_pairs)
+
+        return vocab, merges
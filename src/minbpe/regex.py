@@ -1,24 +1,107 @@
 import collections
+import concurrent.futures
+import itertools
 import typing
 
 import regex as re
 
-from .base import Tokenizer, TokenList, TokenPair, PairCounts, VocabDict, Merges
+from .base import Tokenizer, TokenList, VocabDict, Merges
 
 
 GPT4_SPLIT_PATTERN = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
 
+TEXT_PART_BOUNDARY_PATTERN = r"""\n(?=\S)"""
+'''
+Matches the places where text can be split into parts that are split into chunks
+separately. No chunk of `GPT4_SPLIT_PATTERN` continues past a newline that is
+followed by a non-whitespace character, so splitting the text after such a
+newline gives the same chunks as splitting the whole text.
+'''
+
+
+def _find_chunks(pattern: re.Pattern, text: str) -> typing.List[str]:
+    '''
+    Splits `text` into chunks with `pattern`.
+
+    Args:
+        pattern (Pattern): The compiled pattern with which to split `text`.
+
+        text (str): The text to be split.
+
+    Returns:
+        List[str]: The chunks of `text`, in order.
+    '''
+
+    return pattern.findall(text)
+
+
+def _count_chunks(pattern: re.Pattern, text: str) -> typing.Counter[bytes]:
+    '''
+    Splits `text` into chunks with `pattern` and counts the number of times each
+    chunk occurs. This is a module-level function so that it can be run in a
+    worker process.
+
+    Args:
+        pattern (Pattern): The compiled pattern with which to split `text`.
+
+        text (str): The text to be split.
+
+    Returns:
+        Counter[bytes]: A counter mapping the UTF-8 bytes of every chunk of
+        `text` to the number of times it occurs.
+    '''
+
+    text_chunks = _find_chunks(pattern, text)
+
+    # Encoding the chunks with `map` keeps the loop over the chunks in C
+    return collections.Counter(map(str.encode, text_chunks))
+
 
 class RegexTokenizer(Tokenizer):
 
     _vocab: typing.Optional[VocabDict]
     _merges: typing.Optional[Merges]
+    _merges_per_pass: int
+    _processes: int
+    _last_text: typing.Optional[str]
+    _last_chunks: typing.Optional[typing.List[str]]
+
+    def __init__(self, merges_per_pass: int = 1, processes: int = 1):
+        '''
+        Args:
+            merges_per_pass (int): The maximum number of merges to apply in a
+                single pass over the tokens during training. Only pairs that do
+                not share any tokens are merged together in a pass. Merging
+                more than one pair per pass speeds up training, but the learned
+                merges may differ slightly from merging one pair at a time,
+                since the counts of the newly formed pairs are not considered
+                until the next pass.
+
+            processes (int): The number of worker processes with which to
+                split the text into chunks and count them during training. The
+                text is split in the current process if this is 1.
+
+        Raises:
+            ValueError: If `merges_per_pass` or `processes` is less than 1.
+        '''
+
+        if merges_per_pass < 1:
+            raise ValueError('merges_per_pass must be at least 1')
+
+        if processes < 1:
+            raise ValueError('processes must be at least 1')
 
-    def __init__(self):
         super().__init__()
         self._vocab = None
         self._merges = None
+        self._merges_per_pass = merges_per_pass
+        self._processes = processes
+        self._last_text = None
+        self._last_chunks = None
         self._compiled_pattern = re.compile(GPT4_SPLIT_PATTERN)
+        self._compiled_part_boundary_pattern = re.compile(
+            TEXT_PART_BOUNDARY_PATTERN
+        )
 
     def train(self, text: str, vocab_size: int):
         '''
@@ -26,16 +109,30 @@ class RegexTokenizer(Tokenizer):
         using the byte pair encoding algorithm.
         '''
 
-        text_chunks = re.findall(self._compiled_pattern, text)
+        # Identical chunks are merged in exactly the same way, so each unique
+        # chunk only needs to be processed once, weighted by how often it occurs
+        if self._processes > 1:
+            chunk_counts = self._count_chunks_in_parallel(text)
 
-        id_chunks = [list(str(chunk).encode('utf-8')) for chunk in text_chunks]
+            # The text is split in the worker processes, so there are no chunks
+            # to keep for encoding it
+            text_chunks = None
+        else:
+            text_chunks = _find_chunks(self._compiled_pattern, text)
+            chunk_counts = collections.Counter(map(str.encode, text_chunks))
 
-        tokens = [[int(id) for id in chunk] for chunk in id_chunks]
+        # The chunks are kept in the order they first occur in the text, so that
+        # pairs that occur equally often are merged in the order they first
+        # occur in the text
+        token_chunks = list(chunk_counts)
+
+        frequencies = list(chunk_counts.values())
 
         number_of_merges = vocab_size - 256
 
         vocab, merges = self._byte_pair_encode(
-            tokens,
+            token_chunks,
+            frequencies,
             vocab_size,
             number_of_merges
         )
@@ -43,20 +140,33 @@ class RegexTokenizer(Tokenizer):
         self._vocab = vocab
         self._merges = merges
 
+        # Keep the chunks of the text, so that encoding the same text does not
+        # split it again. Only the last trained text is kept, and only for as
+        # long as the tokenizer is kept.
+        self._last_text = text if text_chunks is not None else None
+        self._last_chunks = text_chunks
+
     def encode(self, text: str) -> TokenList:
         if self._vocab is None or self._merges is None:
             raise Exception('Tokenizer has not been trained, cannot encode')
 
-        text_chunks = re.findall(self._compiled_pattern, text)
-        text_chunks = [str(chunk) for chunk in text_chunks]
+        if text is self._last_text:
+            text_chunks = self._last_chunks
+        else:
+            text_chunks = _find_chunks(self._compiled_pattern, text)
 
         tokens = []
 
+        # Identical chunks are always encoded to the same tokens, so each unique
+        # chunk only needs to be converted to bytes and merged once
+        chunk_tokens: typing.Dict[str, TokenList] = {}
+
         for chunk in text_chunks:
-            chunk_bytes = chunk.encode('utf-8')
-            token_chunk = list(map(int, chunk_bytes))
-            for pair, replacement_token in self._merges.items():
-                token_chunk = self._merge(token_chunk, pair, replacement_token)
+            token_chunk = chunk_tokens.get(chunk)
+
+            if token_chunk is None:
+                token_chunk = self._apply_merges(chunk.encode('utf-8'))
+                chunk_tokens[chunk] = token_chunk
 
             tokens.extend(token_chunk)
 
@@ -74,143 +184,70 @@ class RegexTokenizer(Tokenizer):
 
         return text
 
-    def _count_pairs(
-        self,
-        tokens: TokenList,
-        pair_counts: PairCounts
-    ) -> PairCounts:
+    def _split_text(self, text: str, number_of_parts: int) -> typing.List[str]:
         '''
-        Counts the number of times each pair of tokens occurs consecutively in
-        `tokens`, updating the counts in `pair_counts`.
+        Splits `text` into roughly `number_of_parts` parts of similar length,
+        such that splitting each part into chunks gives the same chunks as
+        splitting the whole text (see `TEXT_PART_BOUNDARY_PATTERN`).
 
-        Note that if a pair of tokens does not occur consecutively in tokens,
-        then it will not be present in the output dictionary.
+        Note that fewer parts may be returned if `text` does not have enough
+        places where it can be split.
 
         Args:
-            tokens (List[int]): The list of tokens to be processed.
+            text (str): The text to be split into parts.
 
-            pair_counts (Dict[Tuple[int, int], int]): The dictionary of pair
-                counts to be updated.
+            number_of_parts (int): The number of parts to split `text` into.
 
         Returns:
-            PairCounts: The updated dictionary mapping every consecutive pair of
-            tokens that occurs consecutively in `tokens` to the number of times
-            it does so.
+            List[str]: The parts of `text`, in order.
         '''
 
-        for pair in zip(tokens, tokens[1:]):
-            pair_counts[pair] = pair_counts.get(pair, 0) + 1
-
-        return pair_counts
-
-    def _merge(
-        self,
-        tokens: TokenList,
-        pair_to_replace: TokenPair,
-        replacement_token: int
-    ) -> TokenList:
-        '''
-        Merges a list of tokens with a conditional replacement token. Every
-        occurrence of `pair_to_replace` in `tokens` will be replaced by
-        `replacement_token`.
+        parts = []
+        start = 0
 
-        Note that the replacement does not happen in place. A new list of tokens
-        is created and returned.
+        for i in range(1, number_of_parts):
+            boundary = self._compiled_part_boundary_pattern.search(
+                text,
+                max(start, len(text) * i // number_of_parts)
+            )
 
-        Args:
-            tokens (List[int]): The list of tokens to be merged.
+            if boundary is None:
+                break
 
-            pair_to_replace (Tuple[int, int]): The pair of tokens to be replaced
-                by the replacement token wherever it occurs in `tokens`.
+            parts.append(text[start:boundary.end()])
+            start = boundary.end()
 
-            replacement_token (int): The token with which to replace occurrences
-                of the replacement pair in `tokens`.
+        parts.append(text[start:])
 
-        Returns:
-            List[int]: The new list of tokens where every occurrence of
-            `pair_to_replace` in `tokens` has been replaced with
-            `replacement_token`.
-        '''
+        return parts
 
-        new_tokens = []
-        i = 0
-        can_replace: bool
-
-        while i < len(tokens):
-            if i < len(tokens) - 1:
-                can_replace = (
-                    pair_to_replace[0] == tokens[i]
-                    and pair_to_replace[1] == tokens[i+1]
-                )
-            else:
-                can_replace = False
-
-            if can_replace:
-                new_tokens.append(replacement_token)
-                i += 2
-            else:
-                new_tokens.append(tokens[i])
-                i += 1
-
-        return new_tokens
-
-    def _byte_pair_encode(
-        self,
-        token_chunks: typing.List[TokenList],
-        original_vocab_size: int,
-        number_of_merges: int
-    ) -> typing.Tuple[VocabDict, Merges]:
+    def _count_chunks_in_parallel(self, text: str) -> typing.Counter[bytes]:
         '''
-        Applies the byte pair encoding algorithm to a list of chunks of tokens
-        by merging the most frequently occurring pair in the tokens with a new
-        token `number_of_merges` times.
+        Splits `text` into chunks and counts the number of times each chunk
+        occurs, splitting the parts of `text` in `self._processes` worker
+        processes.
 
         Args:
-            token_chunks (List[List[int]]): The list of chunks of tokens on
-                which to apply the byte pair encoding algorithm.
-
-            original_vocab_size (int): The original number of unique tokens in
-                the vocabulary.
-
-            number_of_merges (int): The number of iterations to run the byte
-                pair encoding algorithm. More merges means more pairs of tokens
-                will be replaced by a new token.
+            text (str): The text to be split.
 
         Returns:
-            Tuple[VocabDict, Merges]: A tuple containing:
-            - `VocabDict`: a dictionary mapping each replacement token to the
-              bytes it replaced. Note that the bytes may be more than a pair
-              (like if a replacement token is a replacement of a replacement).
-            - `Merges`: a dictionary mapping pairs of tokens to the new
-              replacement token that replaced the pair, in the order they were
-              applied in.
+            Counter[bytes]: A counter mapping the UTF-8 bytes of every chunk of
+            `text` to the number of times it occurs, in the order the chunks
+            first occur in `text`.
         '''
 
-        merges = collections.OrderedDict()
-        vocab = {idx: bytes([idx]) for idx in range(256)}
-
-        for i in range(number_of_merges):
-            pair_counts = dict()
-            for chunk in token_chunks:
-                # Update the counts of the consecutive pairs of tokens
-                pair_counts = self._count_pairs(chunk, pair_counts)
-
-            # Get the most commonly-occurring consecutive pair of tokens
-            top_pair = max(pair_counts, key=pair_counts.get)
-
-            # Make a new token
-            new_index = original_vocab_size + i
+        parts = self._split_text(text, self._processes)
 
-            # Replace the top pair with the new token in each token chunk
-            token_chunks = [
-                self._merge(chunk, top_pair, new_index)
-                for chunk in token_chunks
-            ]
+        chunk_counts = collections.Counter()
 
-            # Map the top pair to the new token created for it
-            merges[top_pair] = new_index
+        with concurrent.futures.ProcessPoolExecutor(self._processes) as executor:
+            partial_chunk_counts = executor.map(
+                _count_chunks,
+                itertools.repeat(self._compiled_pattern),
+                parts
+            )
 
-            # Map the new token to the pair of tokens that it replaced
-            vocab[new_index] = vocab[top_pair[0]] + vocab[top_pair[1]]
+            for partial in partial_chunk_counts:
+                chunk_counts.update(partial)
 
-        return vocab, merges
+        return chunk_counts
@@ -1,11 +1,60 @@
 import abc
 import unittest
+from unittest import mock
 from pathlib import Path
 import typing
 
-from minbpe.base import Tokenizer
+import regex as re
+
+from minbpe.base import Tokenizer, TokenList, TokenPair, Merges
 from minbpe.basic import BasicTokenizer
-from minbpe.regex import RegexTokenizer
+from minbpe.regex import RegexTokenizer, GPT4_SPLIT_PATTERN, _find_chunks
+
+
+def merge(tokens: TokenList, pair: TokenPair, new_token: int) -> TokenList:
+    '''
+    Replaces every occurrence of `pair` in `tokens` with `new_token`, walking
+    over the tokens from left to right.
+    '''
+
+    merged_tokens = []
+    i = 0
+
+    while i < len(tokens):
+        if i < len(tokens) - 1 and (tokens[i], tokens[i+1]) == pair:
+            merged_tokens.append(new_token)
+            i += 2
+        else:
+            merged_tokens.append(tokens[i])
+            i += 1
+
+    return merged_tokens
+
+
+def learn_merges(chunks: typing.List[str], vocab_size: int) -> Merges:
+    '''
+    Learns merges by recounting every pair of tokens in `chunks` before each
+    merge and merging the pair with the highest count. Of the pairs with the
+    highest count, the one that occurs first is merged.
+    '''
+
+    token_chunks = [list(chunk.encode('utf-8')) for chunk in chunks]
+    merges: Merges = {}
+
+    for new_token in range(vocab_size, 2 * vocab_size - 256):
+        pair_counts: typing.Dict[TokenPair, int] = {}
+        for tokens in token_chunks:
+            for pair in zip(tokens, tokens[1:]):
+                pair_counts[pair] = pair_counts.get(pair, 0) + 1
+
+        top_pair = max(pair_counts, key=pair_counts.get)
+        merges[top_pair] = new_token
+
+        token_chunks = [
+            merge(tokens, top_pair, new_token) for tokens in token_chunks
+        ]
+
+    return merges
 
 
 class TokenizerTest(unittest.TestCase, abc.ABC):
@@ -19,6 +68,13 @@ class TokenizerTest(unittest.TestCase, abc.ABC):
     def make_instance(self) -> Tokenizer:
         pass
 
+    def split_text(self, text: str) -> typing.List[str]:
+        '''
+        Splits `text` into the chunks that the tokenizer merges separately.
+        '''
+
+        return [text]
+
     def setUp(self):
         data_path = Path(__file__).parent / 'data'
 
@@ -54,6 +110,60 @@ class TokenizerTest(unittest.TestCase, abc.ABC):
 
         self.assertEqual(text, decoded)
 
+    def test_vocab_size_larger_than_text_supports(self):
+        if self.skip:
+            self.skipTest('Base class does not need to be tested')
+
+        for text, vocab_size in [('', 300), ('ab', 300), ('aaaaa', 260)]:
+            with self.subTest(text=text, vocab_size=vocab_size):
+                tokenizer = self.make_instance()
+
+                with self.assertRaises(ValueError):
+                    tokenizer.train(text, vocab_size)
+
+    def test_encode_applies_merges_in_order(self):
+        if self.skip:
+            self.skipTest('Base class does not need to be tested')
+
+        training_text = self.llama_text
+        if training_text is None:
+            self.fail('Training data not present')
+
+        text = self.taylor_swift_wikipedia_text
+        if text is None:
+            self.fail('Testing data not present')
+
+        # Merging one pair at a time is slow, so only part of the text is used
+        text = text[:10000]
+
+        tokenizer = self.make_instance()
+
+        tokenizer.train(training_text, 400)
+
+        expected_tokens = []
+        for chunk in self.split_text(text):
+            tokens = list(chunk.encode('utf-8'))
+            for pair, new_token in tokenizer._merges.items():
+                tokens = merge(tokens, pair, new_token)
+            expected_tokens.extend(tokens)
+
+        self.assertEqual(expected_tokens, tokenizer.encode(text))
+
+    def assert_learns_merges(self):
+        training_text = self.llama_text
+        if training_text is None:
+            self.fail('Training data not present')
+
+        tokenizer = self.make_instance()
+        tokenizer.train(training_text, 400)
+
+        chunks = self.split_text(training_text)
+
+        self.assertEqual(
+            list(learn_merges(chunks, 400).items()),
+            list(tokenizer._merges.items())
+        )
+
 
 class BasicTokenizerTest(TokenizerTest):
 
@@ -62,6 +172,9 @@ class BasicTokenizerTest(TokenizerTest):
     def make_instance(self) -> Tokenizer:
         return BasicTokenizer()
 
+    def test_merges(self):
+        self.assert_learns_merges()
+
 
 class RegexTokenizerTest(TokenizerTest):
 
@@ -70,6 +183,93 @@ class RegexTokenizerTest(TokenizerTest):
     def make_instance(self) -> Tokenizer:
         return RegexTokenizer()
 
+    def split_text(self, text: str) -> typing.List[str]:
+        return re.findall(GPT4_SPLIT_PATTERN, text)
+
+    def test_merges(self):
+        self.assert_learns_merges()
+
+    def test_encode_reuses_training_chunks(self):
+        training_text = self.llama_text
+        if training_text is None:
+            self.fail('Training data not present')
+
+        tokenizer = self.make_instance()
+        tokenizer.train(training_text, 400)
+
+        # An equal text that is a different object is split again
+        text_copy = training_text[:-1] + training_text[-1:]
+
+        with mock.patch(
+            'minbpe.regex._find_chunks',
+            wraps=_find_chunks
+        ) as find_chunks:
+            tokens = tokenizer.encode(training_text)
+            find_chunks.assert_not_called()
+
+            self.assertEqual(tokenizer.encode(text_copy), tokens)
+            find_chunks.assert_called_once()
+
+
+class BatchedBasicTokenizerTest(TokenizerTest):
+
+    skip = False
+
+    def make_instance(self) -> Tokenizer:
+        return BasicTokenizer(merges_per_pass=8)
+
+
+class BatchedRegexTokenizerTest(TokenizerTest):
+
+    skip = False
+
+    def make_instance(self) -> Tokenizer:
+        return RegexTokenizer(merges_per_pass=8)
+
+    def split_text(self, text: str) -> typing.List[str]:
+        return re.findall(GPT4_SPLIT_PATTERN, text)
+
+
+class TokenizerArgumentsTest(unittest.TestCase):
+
+    def test_merges_per_pass_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            BasicTokenizer(merges_per_pass=0)
+
+        with self.assertRaises(ValueError):
+            RegexTokenizer(merges_per_pass=0)
+
+    def test_processes_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            RegexTokenizer(processes=0)
+
+
+class ParallelRegexTokenizerTest(TokenizerTest):
+
+    skip = False
+
+    def make_instance(self) -> Tokenizer:
+        return RegexTokenizer(processes=2)
+
+    def split_text(self, text: str) -> typing.List[str]:
+        return re.findall(GPT4_SPLIT_PATTERN, text)
+
+    def test_same_merges_as_one_process(self):
+        training_text = self.llama_text
+        if training_text is None:
+            self.fail('Training data not present')
+
+        tokenizer = self.make_instance()
+        tokenizer.train(training_text, 400)
+
+        one_process_tokenizer = RegexTokenizer()
+        one_process_tokenizer.train(training_text, 400)
+
+        self.assertEqual(
+            list(one_process_tokenizer._merges.items()),
+            list(tokenizer._merges.items())
+        )
+
 
 if __name__ == '__main__':
     unittest.main()